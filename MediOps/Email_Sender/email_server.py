@@ -6,6 +6,7 @@ import os
 from datetime import datetime, timedelta
 import random
 import string
+import time
 from threading import Lock
 from typing import Dict, Tuple
 
@@ -39,6 +40,86 @@ class CredentialStore:
 # Initialize credential store
 credential_store = CredentialStore()
 
+# SMTP reply codes relays use to tell us to slow down
+THROTTLING_REPLY_CODES = {421, 450, 452}
+
+def is_throttling_reply(error: Exception) -> bool:
+    # Only coded replies count; bare disconnects are treated as network errors
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return any(code in THROTTLING_REPLY_CODES
+                   for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code in THROTTLING_REPLY_CODES
+    return False
+
+# Longest a request thread may wait for a send slot before failing fast.
+# This bounds pacing only; SMTP I/O and retry backoff come on top of it.
+MAX_SEND_WAIT = 20  # seconds
+
+class SendRateLimited(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"Send queue is full, retry in {retry_after:.0f} seconds")
+        self.retry_after = retry_after
+
+# Paces outgoing mail and learns the relay's sustainable rate (AIMD)
+class SendRateGovernor:
+    def __init__(self, initial_rate: float = 1.0, min_rate: float = 0.05,
+                 max_rate: float = 5.0, increase_step: float = 0.1,
+                 decrease_factor: float = 0.5, max_wait: float = MAX_SEND_WAIT):
+        self._rate = initial_rate  # emails per second
+        self._min_rate = min_rate
+        self._max_rate = max_rate
+        self._increase_step = increase_step
+        self._decrease_factor = decrease_factor
+        self._max_wait = max_wait
+        self._next_send_time = time.monotonic()
+        self._last_cut_time = float('-inf')
+        self._lock = Lock()
+
+    @property
+    def rate(self) -> float:
+        with self._lock:
+            return self._rate
+
+    def acquire(self) -> Tuple[float, bool]:
+        # Reserve the next dispatch slot, then wait for it outside the lock.
+        # Returns the slot time and whether it was paced behind another send.
+        # Raises SendRateLimited instead of waiting longer than max_wait.
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_send_time)
+            delay = slot - now
+            if delay > self._max_wait:
+                raise SendRateLimited(delay)
+            self._next_send_time = slot + 1.0 / self._rate
+        if delay > 0:
+            time.sleep(delay)
+        return slot, delay > 0
+
+    def record_success(self, paced: bool) -> None:
+        # Only probe upwards when the current rate was actually limiting us
+        if not paced:
+            return
+        with self._lock:
+            self._rate = min(self._max_rate, self._rate + self._increase_step)
+
+    def record_throttle(self, dispatched_at: float) -> None:
+        with self._lock:
+            # Sends dispatched before the last cut belong to the same episode
+            if dispatched_at < self._last_cut_time:
+                return
+            self._last_cut_time = time.monotonic()
+            self._rate = max(self._min_rate, self._rate * self._decrease_factor)
+            # Slots already handed out keep their time; the next reservation
+            # is spaced at the reduced rate
+            self._next_send_time = max(self._next_send_time,
+                                       time.monotonic() + 1.0 / self._rate)
+            rate = self._rate
+        print(f"SMTP throttling detected, send rate lowered to {rate:.2f}/s")
+
+# Initialize send rate governor
+send_rate_governor = SendRateGovernor()
+
 app = Flask(__name__)
 
 # Configure server for better network handling and mobile hotspot connections
@@ -93,7 +174,10 @@ def send_email(to_email, subject, html_content):
         retry_count = 3
         retry_delay = 2  # seconds
 
+        throttle_recorded = False
+
         while retry_count > 0:
+            dispatched_at, paced = send_rate_governor.acquire()
             try:
                 with smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=30) as server:
                     server.ehlo()
@@ -102,15 +186,28 @@ def send_email(to_email, subject, html_content):
                     server.login(SENDER_EMAIL, SENDER_PASSWORD)
                     server.send_message(msg)
                     print(f"Email sent successfully to {to_email}")
+                send_rate_governor.record_success(paced)
                 return True
-            except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError) as e:
+            except smtplib.SMTPException as e:
+                throttled = is_throttling_reply(e)
+                if not throttled and not isinstance(
+                        e, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+                    raise e
+                if throttled and not throttle_recorded:
+                    # Retries of one email are a single congestion event
+                    send_rate_governor.record_throttle(dispatched_at)
+                    throttle_recorded = True
                 retry_count -= 1
-                if retry_count > 0:
-                    print(f"Connection error, retrying in {retry_delay} seconds...")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # Exponential backoff
-                else:
+                if retry_count == 0:
                     raise e
+                # Never retry sooner than the backoff, even when the governor allows it
+                delay = max(retry_delay, 1.0 / send_rate_governor.rate) if throttled else retry_delay
+                reason = "Relay is throttling" if throttled else "Connection error"
+                print(f"{reason}, retrying in {delay:.1f} seconds...")
+                time.sleep(delay)
+                retry_delay *= 2  # Exponential backoff
+    except SendRateLimited:
+        raise
     except smtplib.SMTPAuthenticationError as e:
         print(f"SMTP Authentication Error: {e}")
         return False
@@ -152,6 +249,10 @@ def handle_send_email():
         else:
             return jsonify({"status": "error", "message": "Failed to send OTP email"}), 500
 
+    except SendRateLimited as e:
+        response = jsonify({"status": "error", "message": str(e)})
+        response.headers['Retry-After'] = str(int(e.retry_after) + 1)
+        return response, 503
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
@@ -288,6 +389,10 @@ def handle_send_credentials():
         else:
             return jsonify({"status": "error", "message": "Failed to send credentials email"}), 500
 
+    except SendRateLimited as e:
+        response = jsonify({"status": "error", "message": str(e)})
+        response.headers['Retry-After'] = str(int(e.retry_after) + 1)
+        return response, 503
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
@@ -0,0 +1,125 @@
+import importlib.util
+import os
+import smtplib
+from unittest import mock
+
+import pytest
+
+_spec = importlib.util.spec_from_file_location(
+    "email_server", os.path.join(os.path.dirname(__file__), "email_server.py"))
+email_server = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(email_server)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(email_server.time, "monotonic", fake.monotonic)
+    monkeypatch.setattr(email_server.time, "sleep", fake.sleep)
+    return fake
+
+
+def test_rate_increases_on_paced_success_up_to_max(clock):
+    governor = email_server.SendRateGovernor(initial_rate=4.8, max_rate=5.0, increase_step=0.1)
+    governor.record_success(paced=True)
+    assert governor.rate == pytest.approx(4.9)
+    governor.record_success(paced=True)
+    governor.record_success(paced=True)
+    assert governor.rate == pytest.approx(5.0)
+
+
+def test_rate_unchanged_on_unpaced_success(clock):
+    governor = email_server.SendRateGovernor(initial_rate=1.0)
+    for _ in range(50):
+        governor.record_success(paced=False)
+    assert governor.rate == pytest.approx(1.0)
+
+
+def test_acquire_reports_pacing(clock):
+    governor = email_server.SendRateGovernor(initial_rate=2.0)
+    assert governor.acquire() == (pytest.approx(0.0), False)
+    assert governor.acquire() == (pytest.approx(0.5), True)
+    clock.now += 10
+    assert governor.acquire()[1] is False
+
+
+def test_rate_halves_on_throttle_down_to_min(clock):
+    governor = email_server.SendRateGovernor(initial_rate=1.0, min_rate=0.2)
+    governor.record_throttle(dispatched_at=clock.now)
+    assert governor.rate == pytest.approx(0.5)
+    for _ in range(2):
+        clock.now += 1
+        governor.record_throttle(dispatched_at=clock.now)
+    assert governor.rate == pytest.approx(0.2)
+
+
+def test_throttles_from_sends_before_last_cut_are_ignored(clock):
+    governor = email_server.SendRateGovernor(initial_rate=4.0)
+    dispatched = [governor.acquire()[0] for _ in range(3)]
+    clock.now += 1
+    for dispatched_at in dispatched:
+        governor.record_throttle(dispatched_at)
+    assert governor.rate == pytest.approx(2.0)
+
+
+def test_acquire_spaces_dispatches_at_rate(clock):
+    governor = email_server.SendRateGovernor(initial_rate=2.0)
+    dispatched = []
+    for _ in range(3):
+        governor.acquire()
+        dispatched.append(clock.now)
+    assert dispatched == pytest.approx([0.0, 0.5, 1.0])
+
+
+def test_acquire_fails_fast_past_max_wait(clock):
+    governor = email_server.SendRateGovernor(initial_rate=0.1, max_wait=5)
+    governor.acquire()
+    with pytest.raises(email_server.SendRateLimited):
+        governor.acquire()
+    assert clock.sleeps == []
+
+
+@pytest.mark.parametrize("code", [421, 450, 452])
+def test_throttling_reply_codes(code):
+    assert email_server.is_throttling_reply(smtplib.SMTPDataError(code, b"slow down"))
+
+
+def test_recipients_refused_with_throttling_code():
+    error = smtplib.SMTPRecipientsRefused({"a@example.com": (452, b"too many recipients")})
+    assert email_server.is_throttling_reply(error)
+
+
+def test_non_throttling_errors():
+    assert not email_server.is_throttling_reply(
+        smtplib.SMTPAuthenticationError(535, b"bad credentials"))
+    assert not email_server.is_throttling_reply(
+        smtplib.SMTPRecipientsRefused({"a@example.com": (550, b"no such user")}))
+    assert not email_server.is_throttling_reply(smtplib.SMTPDataError(451, b"local error"))
+    assert not email_server.is_throttling_reply(smtplib.SMTPServerDisconnected())
+
+
+def test_send_email_backs_off_after_throttling_reply(clock, monkeypatch):
+    governor = email_server.SendRateGovernor(initial_rate=5.0)
+    monkeypatch.setattr(email_server, "send_rate_governor", governor)
+    smtp = mock.MagicMock()
+    smtp.return_value.__enter__.return_value.send_message.side_effect = (
+        smtplib.SMTPDataError(421, b"try again later"))
+    monkeypatch.setattr(email_server.smtplib, "SMTP", smtp)
+
+    assert email_server.send_email("a@example.com", "Subject", "<p>Hi</p>") is False
+    assert smtp.call_count == 3
+    assert clock.sleeps == pytest.approx([2, 4])
+    assert governor.rate == pytest.approx(2.5)